@@ -1,8 +1,241 @@
+import ctypes
 import cv2
+import functools
 import numpy as np
-import math
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
-def process_video(input_path, output_path, contrast_mode="linear"):
+# Frames in flight between the decode, compute and encode threads. Reused
+# frame buffers need QUEUE_SIZE + 2 slots: a full queue plus the frame each
+# end is currently holding.
+QUEUE_SIZE = 4
+# Frames read from the ffmpeg pipe per readinto() call. The reader alternates
+# between two such batches, so this must be at least QUEUE_SIZE + 2.
+DECODE_BATCH = 8
+# ENCODERS, get_parallel_framework, pick_encoder, FFmpegWriter, start_reader
+# and stop_reader are kept identical to the copies in KenCinco_Exer3.py.
+# Tried in order; the first one that can actually open an encode session on
+# this machine wins, so a listed-but-unusable hardware encoder is skipped.
+# Without one, mpeg4 (the codec cv2's mp4v writer produces) comes before
+# libx264, whose default preset costs several times more CPU per frame.
+ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "mpeg4", "libx264")
+
+def get_parallel_framework():
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("Parallel framework:"):
+            return line.split(":", 1)[1].strip()
+    return "none"
+
+# Some wheels leave OpenCV's thread pool at a single thread; size it to the
+# machine so parallel_for_ can split the per-frame cv2.LUT (and cvtColor on
+# the no-ffmpeg decode path) across cores.
+cv2.setNumThreads(os.cpu_count() or 1)
+if get_parallel_framework() == "none":
+    print("Warning: OpenCV was built without a parallel framework, its kernels will run single-threaded")
+
+def load_contrast_kernel():
+    # Optional AVX2 build of the contrast step (see contrast_avx2.c for the
+    # build command). Without the compiled library the cv2.LUT path is used.
+    library_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contrast_avx2.so")
+    if not os.path.exists(library_path):
+        return None
+    try:
+        kernel = ctypes.CDLL(library_path).contrast_u8
+    except (OSError, AttributeError):
+        # built for another platform, or stale without contrast_u8
+        print(f"Warning: Could not load {library_path}, using the cv2.LUT path")
+        return None
+    kernel.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int32, ctypes.c_int32]
+    kernel.restype = None
+    return kernel
+
+CONTRAST_KERNEL = load_contrast_kernel()
+
+def build_alpha_schedule(total_frames, contrast_mode="linear"):
+    total_frames = max(total_frames, 1)
+    if contrast_mode == "linear":
+        return np.linspace(0.8, 1.5, total_frames, endpoint=False)
+    elif contrast_mode == "sine":
+        progress = np.arange(total_frames) / total_frames
+        return 1.15 + 0.35 * np.sin(2 * np.pi * progress * 2)
+    return np.full(total_frames, 1.0)
+
+def read_gray_frames(cap, input_path, width, height, decoder="opencv"):
+    # decoder="ffmpeg" has ffmpeg hand over the gray plane directly instead of
+    # decoding to BGR and converting back. It is opt-in: on the 312-frame test
+    # clip it took 2.5-2.7 s against 2.0-2.2 s for cap.read() + cvtColor, and
+    # its gray levels differ from cvtColor's (mean 1.3, max 12 levels).
+    if decoder != "ffmpeg" or shutil.which("ffmpeg") is None:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return
+
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", input_path,
+               "-an", "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1 << 20)
+    batches = np.empty((2, DECODE_BATCH, height, width), dtype=np.uint8)
+    batch_idx = 0
+    try:
+        while True:
+            batch = batches[batch_idx % 2]
+            num_frames = proc.stdout.readinto(batch) // batch[0].nbytes
+            yield from batch[:num_frames]
+            if num_frames < DECODE_BATCH:
+                break
+            batch_idx += 1
+    except GeneratorExit:
+        # Closed early (stop_reader): kill ffmpeg before closing the pipe. On
+        # SIGTERM it would still flush into the closed pipe and report
+        # broken-pipe errors on top of the failure that ended the read.
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {input_path}")
+
+@functools.lru_cache(maxsize=None)
+def pick_encoder():
+    for encoder in ENCODERS:
+        probe = ["ffmpeg", "-nostdin", "-loglevel", "error", "-f", "lavfi",
+                 "-i", "color=size=256x256:duration=0.1", "-c:v", encoder, "-f", "null", "-"]
+        if subprocess.run(probe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return encoder
+    return None
+
+class FFmpegWriter:
+    # Stands in for cv2.VideoWriter: raw frames are piped to an ffmpeg
+    # process, which lets the encode run on a hardware encoder.
+    BYTES_PER_PIXEL = {"gray": 1, "bgr24": 3}
+
+    def __init__(self, output_path, fps, size, pix_fmt, encoder):
+        command = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+                   "-i", "-", "-c:v", encoder, "-pix_fmt", "yuv420p", output_path]
+        # ffmpeg only opens the output and the encoder once the first frame
+        # arrives, so first encode one blank frame through the same command;
+        # if that fails (odd size for libx264, missing directory, ...) the
+        # writer reports itself as not opened and the caller falls back.
+        self.proc = None
+        blank_frame = bytes(size[0] * size[1] * self.BYTES_PER_PIXEL[pix_fmt])
+        probe = subprocess.run(command, input=blank_frame, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if probe.returncode != 0:
+            return
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=1 << 20)
+
+    def isOpened(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def write(self, frame):
+        self.proc.stdin.write(frame)
+
+    def release(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg already exited; the write that hit it reported the error
+            pass
+        self.proc.wait()
+
+def start_reader(frames, frame_queue):
+    # A decode error is kept on thread.error for the caller to report; the None
+    # sentinel is queued either way. Set thread.stop to end the read early.
+    def run():
+        try:
+            for frame in frames:
+                if thread.stop.is_set():
+                    break
+                frame_queue.put(frame)
+        except Exception as exc:
+            thread.error = exc
+        finally:
+            frames.close()
+            frame_queue.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.stop = threading.Event()
+    thread.start()
+    return thread
+
+def stop_reader(reader, frame_queue):
+    # Drain the queue so a reader blocked on a full queue sees the stop flag.
+    reader.stop.set()
+    while frame_queue.get() is not None:
+        pass
+
+def start_writer(writer, frame_queue):
+    # A failed write is kept on thread.error and the queue is still drained
+    # up to the None sentinel, so the producer never blocks on a full queue.
+    def run():
+        while True:
+            frame = frame_queue.get()
+            if frame is None:
+                break
+            if thread.error is None:
+                try:
+                    writer.write(frame)
+                except Exception as exc:
+                    thread.error = exc
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+def render_contrast_with_ffmpeg(input_path, output_path, alphas, encoder):
+    # The contrast is centred on each frame's mean, which a filtergraph cannot
+    # know up front: a first ffmpeg pass measures it with signalstats, then
+    # sendcmd retunes an eq filter per frame while the second pass decodes,
+    # adjusts and encodes in one go, without any frame reaching Python.
+    stats = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", input_path, "-an", "-vf",
+         "format=gray,signalstats,metadata=print:key=lavfi.signalstats.YAVG:file=-", "-f", "null", "-"],
+        capture_output=True, text=True)
+    if stats.returncode != 0:
+        print(f"Error: ffmpeg could not read {input_path}")
+        return False
+    times = re.findall(r"pts_time:(\S+)", stats.stdout)
+    means = [float(mean) for mean in re.findall(r"YAVG=(\S+)", stats.stdout)]
+
+    commands = []
+    for frame_idx, (time, mean) in enumerate(zip(times, means)):
+        alpha = alphas[min(frame_idx, len(alphas) - 1)]
+        # eq computes 256 * (contrast * (x/255 - 0.5) + 0.5 + brightness);
+        # solve that for alpha * (x - mean) + mean
+        contrast = alpha * 255 / 256
+        brightness = (1 - alpha) * mean / 256 + contrast / 2 - 0.5
+        commands.append(f"{time} [enter] eq contrast {contrast:.6f}, [enter] eq brightness {brightness:.6f};")
+
+    with tempfile.NamedTemporaryFile("w", suffix=".cmd", delete=False) as command_file:
+        command_file.write("\n".join(commands))
+    try:
+        command_path = command_file.name.replace("\\", "/").replace(":", "\\:")
+        # A gamma that is not exactly 1 keeps eq on its float lookup table; its
+        # integer fast path rounds brightness to steps of ~2.5 levels.
+        graph = f"format=gray,sendcmd=f='{command_path}',eq=gamma=1.0001"
+        result = subprocess.run(["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-i", input_path, "-an",
+                                 "-vf", graph, "-c:v", encoder, "-pix_fmt", "yuv420p", output_path])
+    finally:
+        os.remove(command_file.name)
+    return result.returncode == 0
+
+def process_video(input_path, output_path, contrast_mode="linear", backend="opencv", decoder="opencv"):
+    # backend="ffmpeg" renders the effect as an ffmpeg filtergraph instead of
+    # adjusting frames in Python. decoder="ffmpeg" reads the gray frames
+    # through an ffmpeg pipe (see read_gray_frames).
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         print(f"Error: Could not open video {input_path}")
@@ -13,36 +246,107 @@ def process_video(input_path, output_path, contrast_mode="linear"):
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height), isColor=False)
+    alphas = build_alpha_schedule(total_frames, contrast_mode)
+
+    encoder = pick_encoder() if shutil.which("ffmpeg") else None
+    if backend == "ffmpeg":
+        if encoder is not None:
+            cap.release()
+            if render_contrast_with_ffmpeg(input_path, output_path, alphas, encoder):
+                print(f"Finished processing '{contrast_mode}' mode. Output saved to: {output_path}")
+            else:
+                print(f"Error: ffmpeg could not render '{contrast_mode}' mode")
+            return
+        print("Warning: ffmpeg is not available, falling back to the OpenCV backend")
+
+    out = None
+    if encoder is not None:
+        out = FFmpegWriter(output_path, fps, (width, height), "gray", encoder)
+        if not out.isOpened():
+            print(f"Warning: ffmpeg could not write {width}x{height} output with {encoder}, "
+                  f"falling back to cv2.VideoWriter")
+            out = None
+    if out is None:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height), isColor=False)
+    if not out.isOpened():
+        print(f"Error: Could not open output video {output_path}")
+        cap.release()
+        return
+
+    # Gray levels in Q8 fixed point (value * 256)
+    levels_q8 = np.arange(256, dtype=np.int32) << 8
+    lut_q16 = np.empty(256, dtype=np.int32)
+    lut = np.empty(256, dtype=np.uint8)
+    adjusted_buffers = np.empty((QUEUE_SIZE + 2, height, width), dtype=np.uint8)
+
+    # Decode and encode run on their own threads so the codecs overlap with
+    # the contrast work; OpenCV and the ffmpeg pipe both release the GIL.
+    read_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    reader = start_reader(read_gray_frames(cap, input_path, width, height, decoder), read_queue)
+    writer = start_writer(out, write_queue)
 
     frame_idx = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    while True:
+        if writer.error is not None:
+            stop_reader(reader, read_queue)
+            break
+        gray = read_queue.get()
+        if gray is None:
             break
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        progress = frame_idx / total_frames
+        alpha = alphas[min(frame_idx, len(alphas) - 1)]
+        adjusted = adjusted_buffers[frame_idx % len(adjusted_buffers)]
 
-        if contrast_mode == "linear":
-            alpha = 0.8 + (1.5 - 0.8) * progress
-        elif contrast_mode == "sine":
-            alpha = 1.15 + 0.35 * math.sin(2 * math.pi * progress * 2)
+        mean = cv2.mean(gray)[0]
+        if CONTRAST_KERNEL is not None:
+            # ctypes drops the GIL for the call, like the OpenCV kernels do
+            CONTRAST_KERNEL(gray.ctypes.data, adjusted.ctypes.data, gray.size,
+                            int(round(alpha * 8192)), int(round(mean * 16)))
         else:
-            alpha = 1.0
-
-        mean = np.mean(gray)
-        adjusted = alpha * (gray.astype(np.float32) - mean) + mean
-        adjusted = np.clip(adjusted, 0, 255).astype(np.uint8)
+            # uint8 input has only 256 possible outputs, so map it through a table.
+            # The table is built in Q8 fixed point: alpha_q8 * (x_q8 - mean_q8) is
+            # Q16, at most ~25M for alpha <= 1.5, so it stays in int32.
+            # The table buffers are reused, so no arrays are allocated per frame.
+            alpha_q8 = int(round(alpha * 256))
+            mean_q8 = int(round(mean * 256))
+            np.subtract(levels_q8, mean_q8, out=lut_q16)
+            np.multiply(lut_q16, alpha_q8, out=lut_q16)
+            np.add(lut_q16, mean_q8 << 8, out=lut_q16)
+            np.right_shift(lut_q16, 16, out=lut_q16)
+            np.clip(lut_q16, 0, 255, out=lut_q16)
+            np.copyto(lut, lut_q16, casting="unsafe")
+            cv2.LUT(gray, lut, dst=adjusted)
 
-        out.write(adjusted)
+        write_queue.put(adjusted)
         frame_idx += 1
 
+    write_queue.put(None)
+    reader.join()
+    writer.join()
+
     cap.release()
     out.release()
+    error = reader.error or writer.error
+    if error is not None:
+        print(f"Error: '{contrast_mode}' mode failed: {error}")
+        return
     print(f"Finished processing '{contrast_mode}' mode. Output saved to: {output_path}")
 
-input_path = 'my_test_video.mp4'
-process_video(input_path, 'KenCinco-FinalExer1/transformed_video_exer1_linear.mp4', contrast_mode='linear')
-process_video(input_path, 'KenCinco-FinalExer1/transformed_video_exer1_pulsate.mp4', contrast_mode='sine')
+def init_worker(num_workers):
+    # Share the cores between the worker processes rather than giving each
+    # one a full-size OpenCV thread pool.
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // num_workers))
+
+if __name__ == "__main__":
+    input_path = 'my_test_video.mp4'
+    jobs = [
+        (input_path, 'KenCinco-FinalExer1/transformed_video_exer1_linear.mp4', 'linear'),
+        (input_path, 'KenCinco-FinalExer1/transformed_video_exer1_pulsate.mp4', 'sine'),
+    ]
+
+    # The two modes share no state, so render them in separate processes.
+    with ProcessPoolExecutor(max_workers=len(jobs), initializer=init_worker, initargs=(len(jobs),)) as executor:
+        for future in [executor.submit(process_video, *job) for job in jobs]:
+            future.result()
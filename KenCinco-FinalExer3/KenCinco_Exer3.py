@@ -1,9 +1,42 @@
 import cv2
+import functools
 import numpy as np
 import os
+import queue
+import shutil
+import subprocess
+import threading
+
+# Frames in flight between the decode, compute and encode threads.
+QUEUE_SIZE = 4
+
+# ENCODERS, get_parallel_framework, pick_encoder, FFmpegWriter, start_reader
+# and stop_reader are kept identical to the copies in KenCinco_Exer1.py.
+# Tried in order; the first one that can actually open an encode session on
+# this machine wins, so a listed-but-unusable hardware encoder is skipped.
+# Without one, mpeg4 (the codec cv2's mp4v writer produces) comes before
+# libx264, whose default preset costs several times more CPU per frame.
+ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "mpeg4", "libx264")
+
+def get_parallel_framework():
+    for line in cv2.getBuildInformation().splitlines():
+        if line.strip().startswith("Parallel framework:"):
+            return line.split(":", 1)[1].strip()
+    return "none"
+
+# Some wheels leave OpenCV's thread pool at a single thread; size it to the
+# machine so parallel_for_ splits each frame's warpAffine calls across cores.
+cv2.setNumThreads(os.cpu_count() or 1)
+if get_parallel_framework() == "none":
+    print("Warning: OpenCV was built without a parallel framework, its kernels will run single-threaded")
 
 def create_test_video(output_path="test_video.mp4", duration=5, fps=30, size=(640, 480)):
     print(f"Creating a test video at {output_path}...")
+    encoder = pick_encoder() if shutil.which("ffmpeg") else None
+    if encoder is not None and create_test_video_ffmpeg(output_path, duration, fps, size, encoder):
+        print(f"Test video created successfully at {output_path}")
+        return output_path
+
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     
     try:
@@ -16,16 +49,21 @@ def create_test_video(output_path="test_video.mp4", duration=5, fps=30, size=(64
             out = cv2.VideoWriter(output_path, fourcc, fps, size)
             
         total_frames = duration * fps
+        frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        
+        theta = np.arange(total_frames) * 2 * np.pi / total_frames
+        sin_theta = np.sin(theta)
+        cos_theta = np.cos(theta)
         
         for i in range(total_frames):
-            frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+            frame.fill(0)
             
-            center_x = int(size[0] * (0.5 + 0.3 * np.sin(i * 2 * np.pi / total_frames)))
-            center_y = int(size[1] * (0.5 + 0.3 * np.cos(i * 2 * np.pi / total_frames)))
+            center_x = int(size[0] * (0.5 + 0.3 * sin_theta[i]))
+            center_y = int(size[1] * (0.5 + 0.3 * cos_theta[i]))
             cv2.circle(frame, (center_x, center_y), 50, (0, 0, 255), -1)
             
-            rect_x = int(size[0] * (0.5 + 0.3 * np.cos(i * 2 * np.pi / total_frames)))
-            rect_y = int(size[1] * (0.5 + 0.3 * np.sin(i * 2 * np.pi / total_frames)))
+            rect_x = int(size[0] * (0.5 + 0.3 * cos_theta[i]))
+            rect_y = int(size[1] * (0.5 + 0.3 * sin_theta[i]))
             cv2.rectangle(frame, (rect_x-30, rect_y-30), (rect_x+30, rect_y+30), (0, 255, 0), -1)
             
             cv2.putText(frame, f"Frame: {i}/{total_frames}", (20, 30), 
@@ -41,7 +79,243 @@ def create_test_video(output_path="test_video.mp4", duration=5, fps=30, size=(64
         print(f"Error creating test video: {str(e)}")
         return None
 
-def apply_gradual_rotation(input_path, output_path_normal, output_path_scaled, final_angle=360):
+@functools.lru_cache(maxsize=None)
+def pick_encoder():
+    for encoder in ENCODERS:
+        probe = ["ffmpeg", "-nostdin", "-loglevel", "error", "-f", "lavfi",
+                 "-i", "color=size=256x256:duration=0.1", "-c:v", encoder, "-f", "null", "-"]
+        if subprocess.run(probe, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return encoder
+    return None
+
+class FFmpegWriter:
+    # Stands in for cv2.VideoWriter: raw frames are piped to an ffmpeg
+    # process, which lets the encode run on a hardware encoder.
+    BYTES_PER_PIXEL = {"gray": 1, "bgr24": 3}
+
+    def __init__(self, output_path, fps, size, pix_fmt, encoder):
+        command = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+                   "-i", "-", "-c:v", encoder, "-pix_fmt", "yuv420p", output_path]
+        # ffmpeg only opens the output and the encoder once the first frame
+        # arrives, so first encode one blank frame through the same command;
+        # if that fails (odd size for libx264, missing directory, ...) the
+        # writer reports itself as not opened and the caller falls back.
+        self.proc = None
+        blank_frame = bytes(size[0] * size[1] * self.BYTES_PER_PIXEL[pix_fmt])
+        probe = subprocess.run(command, input=blank_frame, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if probe.returncode != 0:
+            return
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=1 << 20)
+
+    def isOpened(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def write(self, frame):
+        self.proc.stdin.write(frame)
+
+    def release(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg already exited; the write that hit it reported the error
+            pass
+        self.proc.wait()
+
+def create_test_video_ffmpeg(output_path, duration, fps, size, encoder):
+    # Same scene as the OpenCV drawing loop, generated by lavfi sources: the
+    # circle and square are overlaid at per-frame positions and drawtext
+    # prints the counter. Needs an ffmpeg built with libfreetype for drawtext;
+    # returns False so the caller can fall back to drawing with OpenCV.
+    width, height = size
+    total_frames = duration * fps
+    # overlay's frame counter n starts at 1, so derive the phase from t
+    theta = f"(2*PI*t/{duration})"
+    source = f"r={fps}:d={duration}"
+    graph = (
+        f"color=c=black:s={width}x{height}:{source}[bg];"
+        f"color=c=red:s=101x101:{source},format=rgba,"
+        f"geq=r=255:g=0:b=0:a='255*lte(hypot(X-50,Y-50),50)'[circle];"
+        f"color=c=0x00FF00:s=61x61:{source}[square];"
+        f"[bg][circle]overlay=format=rgb:x='trunc({width}*(0.5+0.3*sin({theta})))-50':"
+        f"y='trunc({height}*(0.5+0.3*cos({theta})))-50'[bg_circle];"
+        f"[bg_circle][square]overlay=format=rgb:x='trunc({width}*(0.5+0.3*cos({theta})))-30':"
+        f"y='trunc({height}*(0.5+0.3*sin({theta})))-30',"
+        f"drawtext=text='Frame\\: %{{frame_num}}/{total_frames}':x=20:y=30-th:fontsize=20:fontcolor=white"
+    )
+    command = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-filter_complex", graph,
+               "-frames:v", str(total_frames), "-c:v", encoder, "-pix_fmt", "yuv420p", output_path]
+    return subprocess.run(command, stderr=subprocess.DEVNULL).returncode == 0
+
+def read_frames(cap, max_frames):
+    for _ in range(max_frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame
+
+def start_reader(frames, frame_queue):
+    # A decode error is kept on thread.error for the caller to report; the None
+    # sentinel is queued either way. Set thread.stop to end the read early.
+    def run():
+        try:
+            for frame in frames:
+                if thread.stop.is_set():
+                    break
+                frame_queue.put(frame)
+        except Exception as exc:
+            thread.error = exc
+        finally:
+            frames.close()
+            frame_queue.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.stop = threading.Event()
+    thread.start()
+    return thread
+
+def stop_reader(reader, frame_queue):
+    # Drain the queue so a reader blocked on a full queue sees the stop flag.
+    reader.stop.set()
+    while frame_queue.get() is not None:
+        pass
+
+def start_writer(writers, frame_queue):
+    # Each queue item holds one frame per writer, written in the same order.
+    # A failed write is kept on thread.error and the queue is still drained
+    # up to the None sentinel, so the producer never blocks on a full queue.
+    def run():
+        while True:
+            frames = frame_queue.get()
+            if frames is None:
+                break
+            if thread.error is None:
+                try:
+                    for writer, frame in zip(writers, frames):
+                        writer.write(frame)
+                except Exception as exc:
+                    thread.error = exc
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+def compute_scale_table(angles, width, height):
+    angle_rad = np.abs(np.deg2rad(angles))
+    cos_angle = np.abs(np.cos(angle_rad))
+    sin_angle = np.abs(np.sin(angle_rad))
+    new_width = width * cos_angle + height * sin_angle
+    new_height = width * sin_angle + height * cos_angle
+    scales = np.minimum(width / new_width, height / new_height)
+    scales[angles % 90 == 0] = 1.0
+    return scales
+
+def cuda_available():
+    # cv2.cuda.warpAffine only exists in builds with the cudawarping module
+    try:
+        return hasattr(cv2.cuda, "warpAffine") and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+def make_warp(width, height, num_outputs, interpolation=cv2.INTER_LINEAR):
+    # Returns warp(frame, matrices, frame_idx) -> one warped frame per matrix.
+    # Results are written into output buffers allocated once, rotating so
+    # frames still waiting in the write queue are never overwritten. With a
+    # CUDA device the warps run on the GPU against persistent device buffers.
+    size = (width, height)
+    host_outputs = np.empty((num_outputs, QUEUE_SIZE + 2, height, width, 3), dtype=np.uint8)
+    if not cuda_available():
+        def warp(frame, matrices, frame_idx):
+            return tuple(
+                cv2.warpAffine(frame, matrix, size, dst=host_buffers[frame_idx % len(host_buffers)],
+                               flags=interpolation)
+                for matrix, host_buffers in zip(matrices, host_outputs)
+            )
+        return warp
+
+    stream = cv2.cuda_Stream()
+    gpu_frame = cv2.cuda_GpuMat(height, width, cv2.CV_8UC3)
+    gpu_outputs = [cv2.cuda_GpuMat(height, width, cv2.CV_8UC3) for _ in range(num_outputs)]
+
+    def warp(frame, matrices, frame_idx):
+        gpu_frame.upload(frame, stream)
+        warped = []
+        for matrix, gpu_output, host_buffers in zip(matrices, gpu_outputs, host_outputs):
+            cv2.cuda.warpAffine(gpu_frame, matrix, size, dst=gpu_output, flags=interpolation,
+                                stream=stream)
+            host_output = host_buffers[frame_idx % len(host_buffers)]
+            gpu_output.download(stream, host_output)
+            warped.append(host_output)
+        stream.waitForCompletion()
+        return tuple(warped)
+    return warp
+
+def open_writers(output_paths, open_writer):
+    # open_writer(path) builds one writer; all of them must open or none is kept.
+    writers = [open_writer(path) for path in output_paths]
+    if all(writer.isOpened() for writer in writers):
+        return writers
+    for writer in writers:
+        writer.release()
+    return None
+
+def build_rotation_filters(width, height, total_frames, final_angle, interpolation):
+    # Same angle and scale schedule as the OpenCV path, written as ffmpeg
+    # expressions of the frame number n so that the filters evaluate them
+    # per frame. ffmpeg's rotate turns clockwise, getRotationMatrix2D
+    # counter-clockwise, hence the negated angle.
+    angle = f"({final_angle}*n/{max(total_frames - 1, 1)})"
+    angle_rad = f"({angle}*PI/180)"
+    cos_angle = f"abs(cos({angle_rad}))"
+    sin_angle = f"abs(sin({angle_rad}))"
+    scale = (f"if(eq(mod({angle},90),0),1,"
+             f"min({width}/({width}*{cos_angle}+{height}*{sin_angle}),"
+             f"{height}/({width}*{sin_angle}+{height}*{cos_angle})))")
+    nearest = interpolation == cv2.INTER_NEAREST
+
+    rotate = f"rotate=a='-{angle_rad}':ow=iw:oh=ih:c=black:bilinear={0 if nearest else 1}"
+    # rotate cannot scale, so shrink the frame about its centre first and pad
+    # it back to full size before rotating
+    scaled = (f"scale=w='round(iw*{scale})':h='round(ih*{scale})':eval=frame:"
+              f"flags={'neighbor' if nearest else 'bilinear'},"
+              f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black:eval=frame,{rotate}")
+    return rotate, scaled
+
+def render_rotation_with_ffmpeg(input_path, output_paths, encoder, width, height, total_frames,
+                                final_angle, interpolation):
+    # One ffmpeg run decodes the input once, rotates it inside the filtergraph
+    # and encodes every output, so no frame ever reaches Python.
+    rotate, scaled = build_rotation_filters(width, height, total_frames, final_angle, interpolation)
+    chains = [rotate, scaled][-len(output_paths):]
+    labels = [f"out{i}" for i in range(len(chains))]
+    graph = f"[0:v]format=bgr24,split={len(chains)}" + "".join(f"[in{i}]" for i in range(len(chains)))
+    for i, chain in enumerate(chains):
+        graph += f";[in{i}]{chain}[{labels[i]}]"
+
+    command = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-i", input_path, "-filter_complex", graph]
+    for label, path in zip(labels, output_paths):
+        command += ["-map", f"[{label}]", "-frames:v", str(total_frames),
+                    "-c:v", encoder, "-pix_fmt", "yuv420p", path]
+    if subprocess.run(command).returncode != 0:
+        print("Error: ffmpeg could not render the rotation")
+        return False
+
+    if len(output_paths) == 2:
+        print(f"Normal rotation output saved to: {output_paths[0]}")
+    print(f"Scaled rotation output saved to: {output_paths[-1]}")
+    return True
+
+def apply_gradual_rotation(input_path, output_path_normal, output_path_scaled, final_angle=360,
+                           interpolation=cv2.INTER_LINEAR, backend="opencv"):
+    # Pass output_path_normal=None to render only the scaled rotation, which
+    # skips half of the warp work. interpolation=cv2.INTER_NEAREST trades some
+    # edge quality for a cheaper warp. backend="ffmpeg" renders the whole
+    # effect as an ffmpeg filtergraph instead of warping frames in Python.
+    write_normal = output_path_normal is not None
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         print(f"Error: Cannot open {input_path}")
@@ -54,64 +328,100 @@ def apply_gradual_rotation(input_path, output_path_normal, output_path_scaled, f
     
     print(f"Video info: {width}x{height}, {fps} FPS, {total_frames} total frames")
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out_normal = cv2.VideoWriter(output_path_normal, fourcc, fps, (width, height))
-    out_scaled = cv2.VideoWriter(output_path_scaled, fourcc, fps, (width, height))
+    output_paths = [output_path_normal, output_path_scaled] if write_normal else [output_path_scaled]
+    encoder = pick_encoder() if shutil.which("ffmpeg") else None
+    if backend == "ffmpeg":
+        if encoder is not None:
+            cap.release()
+            return render_rotation_with_ffmpeg(input_path, output_paths, encoder, width, height,
+                                               total_frames, final_angle, interpolation)
+        print("Warning: ffmpeg is not available, falling back to the OpenCV backend")
+
+    writers = None
+    if encoder is not None:
+        writers = open_writers(output_paths, lambda path: FFmpegWriter(path, fps, (width, height), "bgr24", encoder))
+        if writers is None:
+            print(f"Warning: ffmpeg could not write {width}x{height} output with {encoder}, "
+                  f"falling back to cv2.VideoWriter")
+    if writers is None:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        writers = open_writers(output_paths, lambda path: cv2.VideoWriter(path, fourcc, fps, (width, height)))
     
-    if not (out_normal.isOpened() and out_scaled.isOpened()):
+    if writers is None:
         print("Warning: Could not initialize VideoWriter with mp4v codec. Trying XVID...")
-        out_normal.release()
-        out_scaled.release()
-        
-        output_path_normal = output_path_normal.replace('.mp4', '.avi')
-        output_path_scaled = output_path_scaled.replace('.mp4', '.avi')
+        output_paths = [path.replace('.mp4', '.avi') for path in output_paths]
         
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        out_normal = cv2.VideoWriter(output_path_normal, fourcc, fps, (width, height))
-        out_scaled = cv2.VideoWriter(output_path_scaled, fourcc, fps, (width, height))
+        writers = open_writers(output_paths, lambda path: cv2.VideoWriter(path, fourcc, fps, (width, height)))
         
-        if not (out_normal.isOpened() and out_scaled.isOpened()):
+        if writers is None:
             print("Error: Could not initialize VideoWriter with available codecs")
             return False
 
     center = (width // 2, height // 2)
+
+    # Angles only depend on the frame index, so build both rotation matrices
+    # for every frame up front: shape (total_frames, 2, 2, 3).
+    # Same expression as the old per-frame final_angle * progress, so frames
+    # that landed exactly on a multiple of 90 degrees still do.
+    angles = final_angle * (np.arange(total_frames) / max(total_frames - 1, 1))
+    scales = compute_scale_table(angles, width, height)
+    rotation_matrices = np.array([
+        (cv2.getRotationMatrix2D(center, angle, 1.0), cv2.getRotationMatrix2D(center, angle, scale))
+        for angle, scale in zip(angles, scales)
+    ])
+
+    warp = make_warp(width, height, len(writers), interpolation)
+
+    # Decode and encode run on their own threads so the codecs overlap with
+    # the two warps; OpenCV releases the GIL inside each of them.
+    read_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    reader = start_reader(read_frames(cap, total_frames), read_queue)
+    writer = start_writer(writers, write_queue)
     
     for frame_idx in range(total_frames):
-        ret, frame = cap.read()
-        if not ret:
+        if writer.error is not None:
+            stop_reader(reader, read_queue)
+            break
+        frame = read_queue.get()
+        if frame is None:
             break
         
-        progress = frame_idx / (total_frames - 1) if total_frames > 1 else 0
-        current_angle = final_angle * progress
-        
-        rotation_matrix = cv2.getRotationMatrix2D(center, current_angle, 1.0)
-        rotated_frame = cv2.warpAffine(frame, rotation_matrix, (width, height))
-        out_normal.write(rotated_frame)
-        
-        angle_rad = np.abs(current_angle * np.pi / 180)
-        
-        scaling_factor = 1.0
-        if current_angle % 90 != 0:
-            cos_angle = np.abs(np.cos(angle_rad))
-            sin_angle = np.abs(np.sin(angle_rad))
-            new_width = width * cos_angle + height * sin_angle
-            new_height = width * sin_angle + height * cos_angle
-            scaling_factor = min(width / new_width, height / new_height)
-        
-        rotation_scale_matrix = cv2.getRotationMatrix2D(center, current_angle, scaling_factor)
-        rotated_scaled_frame = cv2.warpAffine(frame, rotation_scale_matrix, (width, height))
-        out_scaled.write(rotated_scaled_frame)
+        current_angle = angles[frame_idx]
+        scaling_factor = scales[frame_idx]
+        # (normal, scaled) matrices, in the same order as the writers
+        matrices = rotation_matrices[frame_idx, -len(writers):]
+        if current_angle % 360 == 0:
+            # Unrotated and unscaled: every output is the input frame as-is
+            write_queue.put((frame,) * len(writers))
+        elif scaling_factor == 1.0 and len(writers) == 2:
+            # Both matrices are identical, so warp once and write it twice
+            rotated_frame, = warp(frame, matrices[:1], frame_idx)
+            write_queue.put((rotated_frame, rotated_frame))
+        else:
+            write_queue.put(warp(frame, matrices, frame_idx))
         
         if frame_idx % max(1, total_frames // 10) == 0:
             print(f"Processing: {frame_idx}/{total_frames} frames ({frame_idx/total_frames*100:.1f}%), "
                   f"Angle: {current_angle:.1f}°, Scale: {scaling_factor:.3f}")
+
+    write_queue.put(None)
+    reader.join()
+    writer.join()
     
     cap.release()
-    out_normal.release()
-    out_scaled.release()
+    for out in writers:
+        out.release()
     
-    print(f"Normal rotation output saved to: {output_path_normal}")
-    print(f"Scaled rotation output saved to: {output_path_scaled}")
+    error = reader.error or writer.error
+    if error is not None:
+        print(f"Error: Rotation failed: {error}")
+        return False
+
+    if write_normal:
+        print(f"Normal rotation output saved to: {output_paths[0]}")
+    print(f"Scaled rotation output saved to: {output_paths[-1]}")
     return True
 
 if __name__ == "__main__":